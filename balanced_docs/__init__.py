@@ -1,5 +1,5 @@
 import argparse
-import collections
+import collections.abc
 import functools
 import logging
 import os
@@ -75,7 +75,7 @@ class memoized(object):
         self.cache = {}
 
     def __call__(self, *args):
-        if not isinstance(args, collections.Hashable):
+        if not isinstance(args, collections.abc.Hashable):
             # uncacheable. a list, for instance.
             # better to not cache than blow up.
             return self.func(*args)
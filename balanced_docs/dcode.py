@@ -7,6 +7,8 @@ Use the `dcode-default` directive to set default options:
     :cache: true
     :record: /tmp/dcode.record
     :script: some-script
+    :server:
+    :prefetch:
     :{script-option-1}:
     ...
     :{script-option-n}:
@@ -21,78 +23,112 @@ And the `dcode` directive to capture generated rST:
     {content}
 
 Note that default options can be overridden by `dcode`.
+
+With `server` set the script is started once as `some-script --server` and
+kept running. Each directive is then sent to it on stdin as a 4-byte
+big-endian length followed by a JSON object with "args", "kwargs" and
+"content", and the script answers on stdout with a 4-byte big-endian length
+followed by the generated rST.
+
+With `prefetch` set, and the `prefetch` handler connected to Sphinx's
+`source-read` event, the scripts of a document's directives are run
+concurrently before it is parsed. Only use it for scripts that are safe to run
+side by side.
 """
-from collections import defaultdict
+from collections import ChainMap, defaultdict
+import atexit
+import contextlib
 import errno
 import functools
 import hashlib
+import io
 import json
 import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import os
-import pipes
+import re
 import shlex
+import shutil
+import struct
 import subprocess
-import sys
+import tempfile
+import textwrap
+import threading
 
 from docutils import nodes
 from docutils.parsers.rst import directives, Directive
-from docutils.statemachine import ViewList
+from docutils.statemachine import string2lines, ViewList
+
+from .rst import DirectiveParser
 
 logger = logging.getLogger(__name__)
 
+# (option, resolved name, conversion of the option value)
+_OPTIONS = (
+    ('cache', 'cache', lambda v: v),
+    ('ignore', 'ignore', lambda v: True),
+    ('script', 'script', lambda v: v),
+    ('record', 'record', os.path.expanduser),
+    ('server', 'server', lambda v: True),
+    ('prefetch', 'prefetch', lambda v: True),
+    ('section-chars', 'section_chars', lambda v: v),
+    ('section-include', 'section_include', lambda v: v.split()),
+)
+
 
 class DCodeDefaultDirective(Directive):
 
-    class Registry(dict):
-
-        def __init__(self, parent, defaults=None):
-            self.parent = parent
-            super(type(self), self).__init__(defaults or {})
-
-        def __getitem__(self, key):
-            try:
-                return super(type(self), self).__getitem__(key)
-            except KeyError:
-                return self.parent[key]
-
-    default_registry = Registry(
-        None,
-        {'script': None,
-         'cache': None,
-         'record': None,
-         'ignore': False,
-         'section-include': None,
-         'section-chars': '~^',
-         }
-    )
+    default_registry = {
+        'script': None,
+        'cache': None,
+        'record': None,
+        'ignore': False,
+        'server': False,
+        'prefetch': False,
+        'section-include': None,
+        'section-chars': '~^',
+    }
+
+    registry = {None: ChainMap(default_registry)}
 
-    registry = defaultdict(functools.partial(Registry, default_registry))
-    registry[None] = default_registry
+    @classmethod
+    def get_registry(cls, key, registry=None):
+        if registry is None:
+            registry = cls.registry
+        if key not in registry:
+            registry[key] = ChainMap({}, registry[None].maps[-1])
+        return registry[key]
+
+    @classmethod
+    def scratch_registry(cls):
+        """
+        Copy of `registry` that can be expanded into without affecting the
+        directives themselves.
+        """
+        defaults = dict(cls.default_registry)
+        registry = {None: ChainMap(defaults)}
+        for key, r in cls.registry.items():
+            if key is not None:
+                registry[key] = ChainMap(dict(r.maps[0]), defaults)
+        return registry
 
     @classmethod
-    def expand(cls, args, options):
+    def expand(cls, args, options, registry=None):
         if args:
             key = args[0]
         else:
             key = None
-        if 'cache' in options:
-            cls.registry[key]['cache'] = options['cache']
-        if 'script' in options:
-            cls.registry[key]['script'] = options['script']
-        if 'record' in options:
-            cls.registry[key]['record'] = os.path.expanduser(options['record'])
-        if 'ignore' in options:
-            cls.registry[key]['ignore'] = True
-        if 'section-chars' in options:
-            cls.registry[key]['section-chars'] = options['section-chars']
-        if 'section-include' in options:
-            cls.registry[key]['section-include'] = options['section-include'].split()
-        kwargs = dict(
-            (k, v.split())
-            for k, v in options.iteritems()
+        r = cls.get_registry(key, registry)
+        for name, _, convert in _OPTIONS:
+            if name in options:
+                r[name] = convert(options[name])
+        kwargs = {
+            k: v.split() if v else []
+            for k, v in options.items()
             if k not in cls.option_spec_fixed
-        )
-        cls.registry[key].update(kwargs)
+        }
+        r.update(kwargs)
         return []
 
     # Directive
@@ -110,10 +146,12 @@ class DCodeDefaultDirective(Directive):
         'ignore': directives.flag,
         'record': directives.unchanged,
         'ignore': directives.unchanged,
+        'server': directives.flag,
+        'prefetch': directives.flag,
         'section-chars': directives.unchanged,
         'section-include': directives.unchanged,
     })
-    option_spec_fixed = option_spec.keys()
+    option_spec_fixed = frozenset(option_spec)
 
     has_content = False
 
@@ -127,91 +165,72 @@ class DCodeDefaultDirective(Directive):
 class DCodeDirective(Directive):
 
     @classmethod
-    def expand(cls, arguments, options, content):
+    def resolve(cls, arguments, options, registry=None):
+        if registry is None:
+            registry = DCodeDefaultDirective.registry
+
         # key, args
-        if arguments and arguments[0] in DCodeDefaultDirective.registry:
+        if arguments and arguments[0] in registry:
             key = arguments[0]
             args = arguments[1:]
         else:
             key = None
             args = arguments[:]
-
-        # cache
-        if 'cache' in options:
-            cache = options['cache']
-        else:
-            cache = DCodeDefaultDirective.registry[key]['cache']
-
-        # ignore
-        if 'ignore' in options:
-            ignore = True
-        else:
-            ignore = DCodeDefaultDirective.registry[key]['ignore']
-
-        # script
-        if 'script' in options:
-            script = options['script']
-        else:
-            script = DCodeDefaultDirective.registry[key]['script']
-
-        # record
-        if 'record' in options:
-            record = os.path.expanduser(options['record'])
-        else:
-            record = DCodeDefaultDirective.registry[key]['record']
-
-        # section-*
-        if 'section-chars' in options:
-            section_chars = options['section-chars']
-        else:
-            section_chars = DCodeDefaultDirective.registry[key]['section-chars']
-        if 'section-include' in options:
-            section_include = options['section-include'].split()
-        else:
-            section_include = DCodeDefaultDirective.registry[key]['section-include']
+        r = DCodeDefaultDirective.get_registry(key, registry)
+        resolved = {
+            attr: convert(options[name]) if name in options else r[name]
+            for name, attr, convert in _OPTIONS
+        }
 
         # kwargs
-        excludes = cls.option_spec_fixed + DCodeDefaultDirective.option_spec_fixed
-        kwargs = dict(
-            (k, v)
-            for k, v in DCodeDefaultDirective.registry[key].iteritems()
-            if k not in excludes
-        )
-        kwargs.update(dict(
-            (k, v.split())
-            for k, v in options.iteritems()
-            if k not in excludes
-        ))
+        kwargs = {
+            k: v
+            for k, v in r.maps[0].items()
+            if k not in _EXCLUDED
+        }
+        kwargs.update({
+            k: v.split() if v else []
+            for k, v in options.items()
+            if k not in _EXCLUDED
+        })
+
+        resolved.update(key=key, args=args, kwargs=kwargs)
+        return resolved
+
+    @classmethod
+    def expand(cls, arguments, options, content):
+        r = cls.resolve(arguments, options)
 
         # generate
-        if not script:
-            raise ValueError('No scripts for key "{0}"'.format(key))
+        if not r['script']:
+            raise ValueError('No scripts for key "{0}"'.format(r['key']))
         view = ViewList()
 
         def write(l):
             view.append(l if l.strip() else '', '<dcode>')
 
-        if section_include:
+        if r['section_include']:
             write = _SectionFilter(
-                section_chars,
-                section_include,
+                r['section_chars'],
+                r['section_include'],
                 write,
             )
 
-        if not ignore:
+        if not r['ignore']:
             if isinstance(content, list):
                 content = '\n'.join(content)
             _generate(
-                cache_file=cache,
-                record=record,
+                cache_file=r['cache'],
+                record=r['record'],
+                server=r['server'],
                 write=write,
-                script=script,
-                args=args,
-                kwargs=kwargs,
+                script=r['script'],
+                args=r['args'],
+                kwargs=r['kwargs'],
                 content=content,
             )
 
-        if section_include:
+        if r['section_include']:
             write.done()
 
         return view
@@ -229,10 +248,12 @@ class DCodeDirective(Directive):
         'cache': directives.flag,
         'script': directives.unchanged,
         'record': directives.unchanged,
+        'server': directives.flag,
+        'prefetch': directives.flag,
         'section-include': directives.unchanged,
         'section-chars': directives.unchanged,
     })
-    option_spec_fixed = option_spec.keys()
+    option_spec_fixed = frozenset(option_spec)
 
     has_content = True
 
@@ -248,37 +269,193 @@ class DCodeDirective(Directive):
         return node.children
 
 
+# options that are not passed on to scripts
+_EXCLUDED = (
+    DCodeDirective.option_spec_fixed | DCodeDefaultDirective.option_spec_fixed
+)
+
+
+def prefetch(app, docname, source):
+    """
+    Sphinx `source-read` handler that runs the scripts of every `dcode`
+    directive with `prefetch` set in a document concurrently, before the
+    document is parsed. The directives then pick up their output, or failure,
+    instead of executing the scripts one after the other.
+    """
+    if ':prefetch:' not in source[0] and not any(
+            r['prefetch'] for r in DCodeDefaultDirective.registry.values()):
+        return
+    # split the way docutils does so scanned content, and so its cache key,
+    # matches what the directive gets
+    settings = getattr(getattr(app, 'env', None), 'settings', None) or {}
+    lines = string2lines(
+        source[0],
+        tab_width=settings.get('tab_width', 8),
+        convert_whitespace=True,
+    )
+    # defaults are applied to a throwaway copy, the directives set them for
+    # real, in document order, once it is parsed
+    registry = DCodeDefaultDirective.scratch_registry()
+    jobs, queued = [], set()
+    for name, args, opts, content in _scan(lines):
+        try:
+            if name == DCodeDefaultDirective.name:
+                DCodeDefaultDirective.expand(args, opts, registry)
+                continue
+            r = DCodeDirective.resolve(args, opts, registry)
+        except Exception as ex:
+            logger.debug('unable to prefetch "%s" - %s', args, ex)
+            continue
+        if not r['prefetch'] or r['ignore'] or r['server'] or not r['script']:
+            continue
+        content = content.encode('utf-8')
+        key = Cache.key(r['script'], r['args'], r['kwargs'], content)
+        if key in _PREFETCHED or key in queued:
+            continue
+        if r['cache'] and key in Cache.open(r['cache']):
+            continue
+        jobs.append((
+            key, r['script'], r['args'], r['kwargs'], content, r['record'],
+        ))
+        queued.add(key)
+    if not jobs:
+        return
+    logger.debug('prefetching %s script(s) for "%s"', len(jobs), docname)
+    pool = ThreadPool(min(len(jobs), multiprocessing.cpu_count()))
+    try:
+        results = pool.map(_prefetch, jobs)
+    finally:
+        pool.close()
+        pool.join()
+    for job, result in zip(jobs, results):
+        _PREFETCHED[job[0]] = result
+
+
 # internals
 
+_PREFETCHED = {}
+
+_EXECUTABLES = {}
+
+_WORKERS = {}
+
+_WORKER_LOCKS = {}
+
+_INFLIGHT = {}
+
+_INFLIGHT_LOCK = threading.Lock()
+
+
+_DIRECTIVE_RE = re.compile(r'(\s*)\.\.\s+([\w.:+-]+?) ?::( |$)')
+
+_COMMENT_RE = re.compile(r'(\s*)\.\.(\s+(?![\[_|])|$)')
+
+_LITERAL_RE = re.compile(r'(\s*)(.*\S)?::\s*$')
+
+# directives whose content docutils does not parse as rST
+_LITERAL_DIRECTIVES = frozenset([
+    'code', 'code-block', 'sourcecode', 'parsed-literal', 'raw',
+])
+
+
+def _scan(lines):
+    classes = {
+        DCodeDefaultDirective.name: DCodeDefaultDirective,
+        DCodeDirective.name: DCodeDirective,
+    }
+    parsers = []
+    parser = None
+    # indent of the comment, literal block or literal directive being skipped
+    skip = None
+    for line in lines:
+        if parser is not None:
+            parser(line)
+            if not parser.done:
+                continue
+            parser = None
+        if skip is not None:
+            if not line.strip() or len(line) - len(line.lstrip()) > skip:
+                continue
+            skip = None
+        name = DirectiveParser.probe(line)
+        if name in classes:
+            parser = DirectiveParser(name, classes[name].has_content, None)
+            parser(line)
+            parsers.append(parser)
+            continue
+        m = _DIRECTIVE_RE.match(line)
+        if m:
+            if m.group(2) in _LITERAL_DIRECTIVES:
+                skip = len(m.group(1))
+            continue
+        m = _COMMENT_RE.match(line) or _LITERAL_RE.match(line)
+        if m:
+            skip = len(m.group(1))
+    for parser in parsers:
+        option_spec = classes[parser.name].option_spec
+        try:
+            opts = {k: option_spec[k](v) for k, v in parser.opts.items()}
+        except ValueError:
+            continue
+        content = textwrap.dedent('\n'.join(parser.content)).strip('\n')
+        yield parser.name, parser.args, opts, content
+
+
+def _prefetch(job):
+    key, script, args, kwargs, content, record = job
+    try:
+        return ''.join(_execute(script, args, kwargs, content, record))
+    except Exception as ex:
+        # handed to the directive, which raises it rather than re-running
+        logger.debug('prefetch failed for "%s" - %s', key, ex)
+        return ex
+
+
 class _SectionFilter(object):
 
     INCLUDE_SEPARATOR = '.'
 
+    INCLUDE_END = None
+
+    ADORNMENT_RE = re.compile(r'([^\w\s]|_)\1*(?=\s*$)')
+
     def __init__(self, chars, include, write):
         self.chars = chars
         self.write = write
         self.filtered = False
         self.include = [
-            map(lambda x: x.lower(), i.split(self.INCLUDE_SEPARATOR))
+            [x.lower() for x in i.split(self.INCLUDE_SEPARATOR)]
             for i in include
         ]
+        # trie of lowered headings, INCLUDE_END marks a complete include
+        self._root = {}
+        for i in self.include:
+            node = self._root
+            for part in i:
+                node = node.setdefault(part, {})
+            node[self.INCLUDE_END] = True
+        self._cursor = self._root
         self._depth = 0
         self._chars = None
         self._h = None
+        self._h_len = None
+        self._debug = logger.isEnabledFor(logging.DEBUG)
 
     def __call__(self, l):
-        if self._h:
-            if self._is_section(self._h, l):
-                self._on_section(self._h, l)
-            else:
-                self._write(self._h)
-                self._write(l)
+        # called for every generated line so writes are inlined
+        h = self._h
+        if h:
             self._h = None
-            return
-        if l and not l[0].isspace():
+            if self._is_section(l):
+                self._on_section(h, l)
+            elif self.filtered:
+                self.write(h)
+                self.write(l)
+        elif l and not l[0].isspace():
             self._h = l
-            return
-        self._write(l)
+            self._h_len = len(l.rstrip())
+        elif self.filtered:
+            self.write(l)
 
     def done(self):
         if self._h:
@@ -289,15 +466,9 @@ class _SectionFilter(object):
         if self.filtered:
             self.write(l)
 
-    def _is_section(self, heading, adornment):
-        h = heading.rstrip()
-        a = adornment.rstrip()
-        return (
-            a and
-            len(a) == len(h) and
-            not a[0].isalnum() and
-            len(set(a)) == 1
-        )
+    def _is_section(self, adornment):
+        m = self.ADORNMENT_RE.match(adornment)
+        return m is not None and m.end() == self._h_len
 
     def _on_section(self, heading, adorment):
         if self.filtered:
@@ -305,28 +476,75 @@ class _SectionFilter(object):
                 self._write(heading)
                 self._write(adorment)
             else:
-                logger.debug('filtering off for "%s", "%s"', heading, adorment)
+                if self._debug:
+                    logger.debug('filtering off for "%s", "%s"', heading, adorment)
                 self.filtered = False
                 self._depth = 0
+                self._cursor = self._root
                 self._on_section(heading, adorment)
         else:
             if self.chars[self._depth] != adorment[0]:
                 self._depth = 0
+                self._cursor = self._root
             else:
-                for i in self.include:
-                    if len(i) <= self._depth:
-                        continue
-                    if i[self._depth] == heading.lower():
-                        self._depth += 1
-                        if len(i) == self._depth:
+                node = self._cursor.get(heading.lower())
+                if node is not None:
+                    self._depth += 1
+                    self._cursor = node
+                    if self.INCLUDE_END in node:
+                        if self._debug:
                             logger.debug('filtering on for "%s", "%s"', heading, adorment)
-                            self._chars = self.chars[self._depth:]
-                            self.filtered = True
+                        self._chars = self.chars[self._depth:]
+                        self.filtered = True
 
 
 def _execute(script, args, kwargs, content, record=None):
+    """
+    Runs `script` with `content` (bytes) on stdin and yields its stdout line
+    by line as it is produced.
+    """
+    cmd = _command(script, args, kwargs, record)
+    with tempfile.TemporaryFile() as stderr:
+        # an absolute executable and close_fds=False (our own descriptors
+        # are non-inheritable anyway) let Popen use posix_spawn
+        proc = subprocess.Popen(
+            cmd,
+            executable=_which(cmd[0]),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            close_fds=False,
+        )
+        feeder = threading.Thread(target=_feed, args=(proc.stdin, content))
+        feeder.daemon = True
+        feeder.start()
+        stdout = io.TextIOWrapper(proc.stdout, encoding='utf-8')
+        finished = False
+        try:
+            for line in stdout:
+                yield line
+            finished = True
+        finally:
+            # the consumer may stop early (close, error), don't leave the
+            # script running behind us
+            stdout.close()
+            if not finished and proc.poll() is None:
+                proc.kill()
+            feeder.join()
+            proc.wait()
+        if proc.returncode != 0:
+            stderr.seek(0)
+            sh_cmd = _quote(cmd)
+            logger.error(
+                '%s - failed with exit code %d\nstderr:\n%s',
+                sh_cmd, proc.returncode, stderr.read().decode('utf-8', 'replace'),
+            )
+            raise Exception('{0} - failed with exit code {1}'.format(sh_cmd, proc.returncode))
+
+
+def _command(script, args, kwargs, record=None):
     args = args[:]
-    for k, v in kwargs.iteritems():
+    for k, v in kwargs.items():
         if isinstance(v, list):
             args.extend('--{0}={1}'.format(k, str(vv)) for vv in v)
         elif isinstance(v, bool):
@@ -334,46 +552,180 @@ def _execute(script, args, kwargs, content, record=None):
         else:
             args.append('--{0}={1}'.format(k, str(v)))
     cmd = (
-        shlex.split(script.encode('utf-8')) +
+        list(_split_script(script)) +
         args
     )
-    sh_cmd = ' '.join(pipes.quote(p) for p in cmd)
-    logger.debug('executing "%s"', sh_cmd)
-    if record:
-        with open(record, 'a') as fo:
-            fo.write(sh_cmd + '\n')
-    proc = subprocess.Popen(
-        cmd,
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    stdout, stderr = proc.communicate(content or '')
-    if proc.returncode != 0:
-        print >>sys.stderr, sh_cmd, '- failed with exit code', proc.returncode
-        print >>sys.stderr, 'stderr:'
-        print >>sys.stderr, stderr
-        print >>sys.stderr, 'stdout:'
-        print >>sys.stderr, stdout
-        raise Exception('{0} - failed with exit code {1}'.format(sh_cmd, proc.returncode))
-    return stdout
+    if record or logger.isEnabledFor(logging.DEBUG):
+        sh_cmd = _quote(cmd)
+        logger.debug('executing "%s"', sh_cmd)
+        if record:
+            with open(record, 'a') as fo:
+                fo.write(sh_cmd + '\n')
+    return cmd
+
+
+@functools.lru_cache(maxsize=256)
+def _split_script(script):
+    return tuple(shlex.split(script))
+
+
+def _quote(cmd):
+    return ' '.join(shlex.quote(p) for p in cmd)
+
+
+def _request(script, args, kwargs, content, record=None):
+    """
+    Sends a request to the long-lived `--server` worker for `script` and
+    returns the rST it generates.
+    """
+    if record or logger.isEnabledFor(logging.DEBUG):
+        _command(script, args, kwargs, record)
+    payload = json.dumps({
+        'args': args,
+        'kwargs': kwargs,
+        'content': content or '',
+    }).encode('utf-8')
+    # one request at a time per worker, their frames share its pipes
+    with _WORKER_LOCKS.setdefault(script, threading.Lock()):
+        worker = _WORKERS.get(script)
+        if worker is not None and worker.poll() is not None:
+            _close_worker(worker)
+            worker = None
+        if worker is None:
+            cmd = list(_split_script(script)) + ['--server']
+            logger.debug('starting worker "%s"', script)
+            worker = subprocess.Popen(
+                cmd,
+                executable=_which(cmd[0]),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                bufsize=0,
+                close_fds=False,
+            )
+            _WORKERS[script] = worker
+        try:
+            _write(worker.stdin, struct.pack('>I', len(payload)) + payload)
+            size, = struct.unpack('>I', _read(worker.stdout, 4))
+            return _read(worker.stdout, size).decode('utf-8')
+        except (IOError, EOFError) as ex:
+            # out of step with us now, the next request starts a fresh one
+            del _WORKERS[script]
+            _close_worker(worker)
+            raise Exception(
+                '{0} --server - failed with {1}'.format(script, ex)
+            )
+
+
+def _write(fo, buf):
+    # unbuffered pipes may take only part of a frame per write
+    buf = memoryview(buf)
+    while buf:
+        buf = buf[fo.write(buf):]
+
+
+def _close_worker(worker):
+    if worker.poll() is None:
+        worker.kill()
+    worker.wait()
+    for fo in (worker.stdin, worker.stdout):
+        try:
+            fo.close()
+        except IOError:
+            pass
+
+
+def _read(fo, size):
+    buf = b''
+    while len(buf) < size:
+        chunk = fo.read(size - len(buf))
+        if not chunk:
+            raise EOFError('worker closed stdout')
+        buf += chunk
+    return buf
+
+
+def _stop_workers(timeout=5):
+    for worker in _WORKERS.values():
+        try:
+            worker.stdin.close()
+        except IOError:
+            pass
+        try:
+            worker.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.debug('killing worker %s', worker.pid)
+            worker.kill()
+            worker.wait()
+
+
+atexit.register(_stop_workers)
+
+
+def _which(name):
+    if name not in _EXECUTABLES:
+        path = shutil.which(name)
+        if path is None:
+            return name
+        _EXECUTABLES[name] = os.path.abspath(path)
+    return _EXECUTABLES[name]
+
+
+def _feed(fo, content):
+    try:
+        fo.write(content)
+    except IOError as ex:
+        if ex.errno != errno.EPIPE:
+            raise
+    finally:
+        try:
+            fo.close()
+        except IOError:
+            pass
+
+
+@functools.lru_cache(maxsize=4096)
+def _cache_key(script, args, kwargs_items, content):
+    # bounded memo on the input tuple so repeated directives skip the rehash,
+    # reset with _cache_key.cache_clear()
+    parts = [Cache.VERSION, script]
+    parts.extend(sorted(args))
+    for k, v in kwargs_items:
+        parts.append(k)
+        parts.extend(v)
+    parts = [p.encode('utf-8') for p in parts]
+    parts.append(content)
+    m = hashlib.blake2b(digest_size=16)
+    m.update(b'\0'.join(parts))
+    return m.hexdigest()
 
 
 class Cache(dict):
 
+    VERSION = '1'
+
+    dirty = False
+
+    _opened = {}
+
+    _opened_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, file_path):
+        with cls._opened_lock:
+            if file_path not in cls._opened:
+                cls._opened[file_path] = cls.load(file_path)
+            return cls._opened[file_path]
+
+    @classmethod
+    def flush(cls):
+        for file_path, cache in cls._opened.items():
+            if cache.dirty:
+                cache.save(file_path)
+
     @classmethod
     def key(cls, script, args, kwargs, content):
-        m = hashlib.md5()
-        m.update(script)
-        for arg in sorted(args):
-            m.update(arg)
-        for k, v in sorted(kwargs.items()):
-            m.update(k)
-            for vv in v:
-                m.update(vv)
-        for l in content:
-            m.update(l)
-        return m.hexdigest()
+        kwargs_items = tuple(sorted((k, tuple(v)) for k, v in kwargs.items()))
+        return _cache_key(script, tuple(args), kwargs_items, content)
 
     @classmethod
     def load(self, file_path):
@@ -381,19 +733,48 @@ class Cache(dict):
             with open(file_path, 'r') as fo:
                 cache = Cache(json.load(fo))
                 logger.debug('loaded cache from "%s"', file_path)
-        except IOError, ex:
+        except IOError as ex:
             if ex.errno != errno.ENOENT:
                 raise
             logger.debug('no cache @ "%s"', file_path)
             cache = Cache()
         return cache
 
+    def store(self, key, value):
+        self[key] = value
+        self.dirty = True
+
     def save(self, file_path):
-        with open(file_path, 'w') as fo:
-            json.dump(self, fo, indent=4)
+        # merge with what is on disk so parallel (-j) readers sharing a cache
+        # file don't drop each other's entries, then swap it in atomically
+        merged = Cache.load(file_path)
+        merged.update(self)
+        dir_path = os.path.dirname(os.path.abspath(file_path))
+        fd, tmp_path = tempfile.mkstemp(dir=dir_path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as fo:
+                json.dump(merged, fo, indent=4)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.dirty = False
         logger.debug('saved cache to "%s"', file_path)
 
 
+atexit.register(Cache.flush)
+
+
+def flush(app, doctree):
+    """
+    Sphinx `doctree-read` handler that saves dirty caches once each document
+    has been read, so parallel readers and interrupted builds keep their
+    results, and drops prefetched output no directive picked up.
+    """
+    Cache.flush()
+    _PREFETCHED.clear()
+
+
 def _generate(
         cache_file,
         record,
@@ -401,21 +782,96 @@ def _generate(
         args,
         kwargs,
         content,
-        write
+        write,
+        server=False,
     ):
-    if cache_file:
-        cache = Cache.load(cache_file)
-        key = cache.key(script, args, kwargs, content)
-        if key in cache:
-            logger.debug('cache hit "%s"', key)
-            result = cache[key]
-        else:
-            logger.debug('cache miss "%s"', key)
-            result = _execute(script, args, kwargs, content, record)
-            logger.debug('cache store "%s"', key)
-            cache[key] = result
-            cache.save(cache_file)
-    else:
-        result = _execute(script, args, kwargs, content, record)
-    for line in result.splitlines():
+    # encoded once, hashed for the cache key and piped to the script as is
+    content_b = (content or '').encode('utf-8')
+    if not cache_file:
+        result = None
+        if _PREFETCHED:
+            key = Cache.key(script, args, kwargs, content_b)
+            result = _PREFETCHED.pop(key, None)
+        _output(
+            result, write, script, args, kwargs, content, content_b, record,
+            server,
+        )
+        return
+    cache = Cache.open(cache_file)
+    key = cache.key(script, args, kwargs, content_b)
+    if key not in cache:
+        with _single_flight(key):
+            # re-checked, whoever held the flight before us may have stored it
+            if key not in cache:
+                logger.debug('cache miss "%s"', key)
+                result = _output(
+                    _PREFETCHED.pop(key, None), write, script, args, kwargs,
+                    content, content_b, record, server, store=True,
+                )
+                logger.debug('cache store "%s"', key)
+                cache.store(key, result)
+                return
+    logger.debug('cache hit "%s"', key)
+    for line in cache[key].splitlines():
         write(line)
+
+
+def _output(
+        result,
+        write,
+        script,
+        args,
+        kwargs,
+        content,
+        content_b,
+        record,
+        server,
+        store=False,
+    ):
+    if isinstance(result, Exception):
+        raise result
+    if result is None and server:
+        result = _request(script, args, kwargs, content, record)
+    if result is not None:
+        for line in result.splitlines():
+            write(line)
+        return result
+    # split like str.splitlines() so streamed, cached and served output all
+    # break on the same boundaries (\f, \v, \u2028, ...)
+    # closed as soon as we stop reading, e.g. write() raising, so the script
+    # doesn't outlive us until the generator is collected
+    with contextlib.closing(
+            _execute(script, args, kwargs, content_b, record)) as lines:
+        if not store:
+            for line in lines:
+                for l in line.splitlines():
+                    write(l)
+            return None
+        stored = []
+        for line in lines:
+            for l in line.splitlines():
+                write(l)
+            stored.append(line)
+    return ''.join(stored)
+
+
+@contextlib.contextmanager
+def _single_flight(key):
+    """
+    Lets one thread at a time produce the output for `key`. Threads
+    rendering an identical directive wait for it and then find the result
+    in the cache.
+    """
+    while True:
+        with _INFLIGHT_LOCK:
+            event = _INFLIGHT.get(key)
+            if event is None:
+                event = _INFLIGHT[key] = threading.Event()
+                break
+        event.wait()
+    try:
+        yield
+    finally:
+        with _INFLIGHT_LOCK:
+            del _INFLIGHT[key]
+        event.set()
@@ -178,7 +178,7 @@ class IncludeExcludeFilter(object):
         self.exclude = exclude
 
     def __call__(self, v):
-        if isinstance(v, basestring):
+        if isinstance(v, str):
             v = v.split(self.SEPARATOR)
         if self.include:
             include = any(i(v) for i in self.include)
@@ -266,8 +266,8 @@ class Context(object):
         return v
 
 
-import error
-import form
-import view
-import endpoint
-import enum
+from . import error
+from . import form
+from . import view
+from . import endpoint
+from . import enum
@@ -54,7 +54,7 @@ class _Context(Context):
 
 
 def _format_value(ctx, v):
-    if isinstance(v, basestring):
+    if isinstance(v, str):
         return v
     if v is None:
         return 'null'
@@ -98,7 +98,7 @@ def _generate_field(ctx, field):
                 # default
                 if 'default' in field:
                     default = field['default']
-                    if isinstance(default, basestring) and '\n' in default:
+                    if isinstance(default, str) and '\n' in default:
                         ctx.writer(' ')
                         ctx.writer(default)
                     else:
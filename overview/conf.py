@@ -244,4 +244,6 @@ def setup(app):
     import pygments.lexers.web
     app.add_directive('dcode-default', dcode.DCodeDefaultDirective)
     app.add_directive('dcode', dcode.DCodeDirective)
-    app.add_lexer('node', pygments.lexers.web.JavascriptLexer())
+    app.connect('source-read', dcode.prefetch)
+    app.connect('doctree-read', dcode.flush)
+    app.add_lexer('node', pygments.lexers.web.JavascriptLexer)
@@ -9,4 +9,4 @@ parser = html5parser.HTMLParser(namespaceHTMLElements=False);
 template = parser.parse(sys.stdin.read());
 target = template.xpath('/html/body/div[1]')[0];
 
-print tostring(target)
+print(tostring(target, encoding='unicode'))
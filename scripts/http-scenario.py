@@ -856,9 +856,9 @@ def bank_account_authentications_update(ctx):
     return ctx.last_req, ctx.last_resp
 
 
-class Customer(balanced.Resource):
-    __metaclass__ = balanced.resources.resource_base(
-        collection='customers', resides_under_marketplace=False)
+class Customer(balanced.Resource, metaclass=balanced.resources.resource_base(
+        collection='customers', resides_under_marketplace=False)):
+    pass
 
 balanced.Customer = Customer
 
@@ -938,7 +938,7 @@ def customers_delete(ctx):
 
 SCENARIOS = dict(
     (v.scenario, v)
-    for k, v in globals().iteritems()
+    for k, v in globals().items()
     if hasattr(v, '__call__') and hasattr(v, 'scenario')
 )
 
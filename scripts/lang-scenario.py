@@ -18,12 +18,11 @@ import errno
 import json
 import logging
 import os
-import pipes
 import re
 import shlex
 import subprocess
 import sys
-import urllib
+import urllib.parse
 
 import balanced
 import mako.lookup
@@ -168,7 +167,7 @@ class Storage(dict):
         try:
             with open(self.file_path, 'r') as f:
                 self.update(json.load(f))
-        except IOError, ex:
+        except IOError as ex:
             if ex.errno != errno.ENOENT:
                 raise
             pass
@@ -198,14 +197,14 @@ class Endpoint(object):
         self.ctx = ctx
         self.name = match['name']
         self.methods = match['methods']
-        self.method = filter(lambda x: x != 'HEAD', match['methods'])[0]
+        self.method = [x for x in match['methods'] if x != 'HEAD'][0]
         self.uri = match['path']
 
     @classmethod
     def qualify_uri(cls, ctx, uri, **qs):
         url = ctx.storage['api_location'] + uri
         if qs:
-            url += '?' + urllib.urlencode(qs)
+            url += '?' + urllib.parse.urlencode(qs)
         return url
 
     def format(self, **kwargs):
@@ -213,7 +212,7 @@ class Endpoint(object):
         matches = re.findall(r':(\w+)', self.uri)
         if matches:
             fmt = re.sub(r':(\w+)', r'{\1}', self.uri)
-            for k, v in kwargs.iteritems():
+            for k, v in kwargs.items():
                 if k in matches:
                     args[k] = v
                 else:
@@ -223,7 +222,7 @@ class Endpoint(object):
             args = kwargs
         uri = fmt.format(**args)
         if params:
-            uri += '?' + urllib.urlencode(params)
+            uri += '?' + urllib.parse.urlencode(params)
         url = self.qualify_uri(self.ctx, uri)
         return url
 
@@ -326,7 +325,9 @@ class Scenario(object):
                 'marketplace': self.ctx.marketplace,
             }
             metadata = os.path.join(self.path, 'metadata.py')
-            execfile(metadata, context, context)
+            with open(metadata, 'r') as f:
+                code = compile(f.read(), metadata, 'exec')
+            exec(code, context, context)
             self.ctx.storage[self.name]['request'] = context['request']
         return self.ctx.storage[self.name]['request']
 
@@ -391,7 +392,7 @@ class Scenario(object):
         try:
             definition = template.render(mode='definition', **context).strip()
         except Exception:
-            print mako.exceptions.text_error_template().render()
+            print(mako.exceptions.text_error_template().render())
             raise
 
         # request
@@ -405,7 +406,7 @@ class Scenario(object):
         try:
             request = template.render(mode='request', **context).strip()
         except Exception:
-            print mako.exceptions.text_error_template().render()
+            print(mako.exceptions.text_error_template().render())
             raise
 
         return {
@@ -414,24 +415,22 @@ class Scenario(object):
         }
 
     def _exec(self, cmd):
-        cmd = filter(
-            lambda x: x != '\n',
-            shlex.split(cmd.encode('utf-8'))
-        )
-        sh_cmd = ' '.join(pipes.quote(p) for p in cmd)
+        cmd = [x for x in shlex.split(cmd) if x != '\n']
+        sh_cmd = ' '.join(shlex.quote(p) for p in cmd)
         logger.debug('exeuting - %s', sh_cmd)
         proc = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
+            universal_newlines=True,
         )
         stdout, stderr = proc.communicate()
         if proc.returncode != 0:
-            print >>sys.stderr, sh_cmd, '- exit code', proc.returncode
-            print >>sys.stderr, 'stderr:'
-            print >>sys.stderr, stderr
-            print >>sys.stderr, 'stdout:'
-            print >>sys.stderr, stdout
+            print(sh_cmd, '- exit code', proc.returncode, file=sys.stderr)
+            print('stderr:', file=sys.stderr)
+            print(stderr, file=sys.stderr)
+            print('stdout:', file=sys.stderr)
+            print(stdout, file=sys.stderr)
             raise Exception(
                 '{0} - failed with exit code {1}'
                 .format(sh_cmd, proc.returncode)
@@ -4,7 +4,7 @@ Script used to expand custom rST directives.
 """
 import argparse
 import logging
-from StringIO import StringIO
+from io import StringIO
 import sys
 
 from balanced_docs import dcode, DirectiveParser, LogLevelAction
@@ -134,7 +134,7 @@ def main():
     else:
         fo = open(args.source, 'r')
     for line in expand_directives(fo, args.disabled):
-        print line,
+        sys.stdout.write(line)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,183 @@
+from collections import ChainMap
+import subprocess
+import sys
+import unittest
+from unittest import mock
+
+from docutils.core import publish_doctree
+from docutils.parsers.rst import directives
+
+from balanced_docs import dcode
+
+
+directives.register_directive('dcode-default', dcode.DCodeDefaultDirective)
+directives.register_directive('dcode', dcode.DCodeDirective)
+
+
+class PrefetchTest(unittest.TestCase):
+
+    def setUp(self):
+        defaults = dict(dcode.DCodeDefaultDirective.default_registry)
+        self.addCleanup(self._restore, defaults)
+        self.calls = []
+        patcher = mock.patch.object(dcode, '_execute', self._execute)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _restore(self, defaults):
+        dcode.DCodeDefaultDirective.default_registry.clear()
+        dcode.DCodeDefaultDirective.default_registry.update(defaults)
+        dcode.DCodeDefaultDirective.registry = {
+            None: ChainMap(dcode.DCodeDefaultDirective.default_registry),
+        }
+        dcode._PREFETCHED.clear()
+
+    def _execute(self, script, args, kwargs, content, record=None):
+        self.calls.append((script, args, kwargs, content))
+        yield 'generated\n'
+
+    def _build(self, source):
+        source = [source]
+        dcode.prefetch(None, 'doc', source)
+        prefetched = list(self.calls)
+        publish_doctree(source[0], settings_overrides={'report_level': 5})
+        return prefetched, self.calls[len(prefetched):]
+
+    def test_scanned_key_matches_directive(self):
+        prefetched, rendered = self._build(
+            '.. dcode-default:: k\n'
+            '    :script: gen.sh\n'
+            '    :prefetch:\n'
+            '\n'
+            '.. dcode:: k two\n'
+            '\n'
+            '\tindented\n'
+            '\t  with tabs\n'
+        )
+        self.assertEqual(len(prefetched), 1)
+        self.assertEqual(rendered, [])
+
+    def test_later_defaults_do_not_leak(self):
+        prefetched, rendered = self._build(
+            '.. dcode-default:: k\n'
+            '    :script: gen.sh\n'
+            '    :prefetch:\n'
+            '\n'
+            '.. dcode:: k first\n'
+            '\n'
+            '.. dcode-default:: k\n'
+            '    :lang: ruby\n'
+            '\n'
+            '.. dcode:: k second\n'
+        )
+        self.assertEqual(rendered, [])
+        self.assertEqual(
+            [(args, kwargs) for _, args, kwargs, _ in prefetched],
+            [(['first'], {}), (['second'], {'lang': ['ruby']})],
+        )
+
+    def test_comments_and_literals_are_skipped(self):
+        prefetched, rendered = self._build(
+            '.. dcode-default:: k\n'
+            '    :script: gen.sh\n'
+            '    :prefetch:\n'
+            '\n'
+            '..\n'
+            '    .. dcode-default:: k\n'
+            '        :ignore:\n'
+            '\n'
+            'For example::\n'
+            '\n'
+            '    .. dcode-default:: k\n'
+            '        :lang: ruby\n'
+            '\n'
+            '.. dcode:: k a\n'
+        )
+        self.assertEqual(
+            [(args, kwargs) for _, args, kwargs, _ in prefetched],
+            [(['a'], {})],
+        )
+        self.assertEqual(rendered, [])
+
+    def test_not_scanned_unless_enabled(self):
+        with mock.patch.object(dcode, '_scan') as scan:
+            dcode.prefetch(None, 'doc', ['.. dcode:: k a\n'])
+        self.assertFalse(scan.called)
+        self.assertEqual(dcode.DCodeDefaultDirective.registry.keys(), {None})
+
+
+class ExecuteTest(unittest.TestCase):
+
+    def test_script_stopped_when_write_raises(self):
+        procs = []
+
+        def popen(*args, **kwargs):
+            procs.append(Popen(*args, **kwargs))
+            return procs[-1]
+
+        def write(line):
+            raise ValueError(line)
+
+        Popen = subprocess.Popen
+        script = (
+            '{0} -c "import time; print(1, flush=True); time.sleep(60)"'
+            .format(sys.executable)
+        )
+        with mock.patch.object(dcode.subprocess, 'Popen', popen):
+            try:
+                dcode._generate(None, None, script, [], {}, '', write)
+            except ValueError:
+                # the traceback still holds the frames here
+                self.assertIsNotNone(procs[0].poll())
+            else:
+                self.fail('write() did not raise')
+
+
+class WorkerTest(unittest.TestCase):
+
+    def test_short_writes_send_whole_frame(self):
+        class Pipe(object):
+            def __init__(self):
+                self.data = b''
+
+            def write(self, buf):
+                self.data += bytes(buf[:3])
+                return len(buf[:3])
+
+        pipe = Pipe()
+        dcode._write(pipe, b'0123456789')
+        self.assertEqual(pipe.data, b'0123456789')
+
+
+class SectionFilterTest(unittest.TestCase):
+
+    def _filter(self, include, lines):
+        out = []
+        f = dcode._SectionFilter('~^', include, out.append)
+        for l in lines:
+            f(l)
+        f.done()
+        return out
+
+    def test_include(self):
+        lines = [
+            'Request', '~~~~~~~', 'r', '',
+            'Response', '~~~~~~~~', 'resp',
+        ]
+        self.assertEqual(self._filter(['response'], lines), ['resp'])
+        self.assertEqual(self._filter(['nope'], lines), [])
+
+    def test_letters_are_not_adornment(self):
+        lines = [
+            'Request', '~~~~~~~', '',
+            'éééé', 'éééé', 'r', '',
+            '____', '____', 'off',
+        ]
+        self.assertEqual(
+            self._filter(['request'], lines),
+            ['', 'éééé', 'éééé', 'r', ''],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()